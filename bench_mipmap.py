@@ -0,0 +1,68 @@
+"""
+    Замер выигрыша от мип-уровней текстур на сцене, где почти все стены далеко.
+    Рисует одни и те же кадры камерой с мип-уровнями и без них и выводит время отрисовки стен.
+    Штатные текстуры всего 64x64, поэтому для оценки на текстурах высокого разрешения
+    их можно предварительно растянуть ключом --texture-size
+
+        python bench_mipmap.py --frames 200 --texture-size 64 256 1024
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+import raycast
+import raycast_pygame_demo as demo
+
+
+# длинный пустой зал: из его середины все стены видны издалека
+far_map = ['#' * 60] + ['#' + ' ' * 58 + '#'] * 58 + ['#' * 60]
+
+
+def measure(camera, frames):
+    """
+        Вернёт среднее время отрисовки стен за кадр в миллисекундах
+    """
+    player = camera.player
+    spent = 0.0
+    for _ in range(frames):
+        player.turn_right(360 / frames)
+        camera.raycast()
+        started = time.perf_counter()
+        camera.render_walls()
+        spent += time.perf_counter() - started
+    return spent / frames * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер отрисовки далёких стен с мип-уровнями и без них')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--size', default='480x360', help='размер кадра, ШИРИНАxВЫСОТА')
+    parser.add_argument('--texture-size', type=int, nargs='+', default=[64, 256, 1024],
+                        help='размеры текстур, на которых провести замер')
+    args = parser.parse_args()
+
+    resolution = tuple(int(side) for side in args.size.lower().split('x'))
+    demo.get_root_screen(resolution)
+    level = raycast.Level(len(far_map[0]), len(far_map), ''.join(far_map))
+    screen = pygame.Surface(resolution)
+    for texture_size in args.texture_size:
+        results = {}
+        for mipmaps in (False, True):
+            player = raycast.Player(raycast.Point(30.0, 30.0), 0.0)
+            camera = demo.PGCamera(screen, level, player, depth=40.0, mipmaps=mipmaps)
+            camera.textures = {cell: pygame.transform.scale(texture, (texture_size, texture_size))
+                               for cell, texture in camera.textures.items()}
+            camera.texture_mips = {cell: camera.build_mips(texture) if mipmaps else [texture]
+                                   for cell, texture in camera.textures.items()}
+            results[mipmaps] = measure(camera, args.frames)
+        print(f'textures {texture_size}x{texture_size}: '
+              f'{results[False]:.2f} ms/frame without mipmaps, {results[True]:.2f} ms/frame with mipmaps, '
+              f'speedup {results[False] / results[True]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
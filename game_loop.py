@@ -0,0 +1,81 @@
+import time
+
+
+class SleepClock:
+    """
+        Часы с интерфейсом pygame.time.Clock для окружений без pygame (например, для консольной демки).
+        tick(framerate) засыпает так, чтобы между вызовами проходило не меньше 1/framerate секунды,
+        и возвращает количество миллисекунд, прошедших с предыдущего вызова
+    """
+    def __init__(self):
+        self._last_tick = time.perf_counter()
+
+    def tick(self, framerate=0):
+        if framerate:
+            delay = 1 / framerate - (time.perf_counter() - self._last_tick)
+            if delay > 0:
+                time.sleep(delay)
+        now = time.perf_counter()
+        elapsed = now - self._last_tick
+        self._last_tick = now
+        return int(elapsed * 1000)
+
+
+class GameLoop:
+    """
+        Игровой цикл с фиксированным шагом симуляции.
+        Симуляция (update) вызывается строго tick_rate раз в секунду независимо от частоты кадров,
+        поэтому скорость игрока больше не зависит от того, насколько быстро рисуется кадр.
+        Рендер (render) вызывается не чаще max_fps раз в секунду и получает alpha — долю времени,
+        прошедшую с последнего тика, чтобы плавно интерполировать позу между двумя тиками.
+        Если за тик ничего не изменилось, кадр не перерисовывается, а цикл «засыпает» до idle_fps итераций в секунду
+    """
+    def __init__(self, update, render, tick_rate=30, max_fps=60, idle_fps=20, max_frame_time=0.25, clock=None):
+        self.update = update        # update() -> True, если состояние игры за тик изменилось
+        self.render = render        # render(alpha), alpha из [0, 1)
+        self.tick_time = 1 / tick_rate
+        self.max_fps = max_fps
+        self.idle_fps = idle_fps
+        # ограничиваем время кадра сверху, чтобы после долгой паузы (например, перетаскивания окна)
+        # симуляция не пыталась наверстать сотни тиков подряд
+        self.max_frame_time = max_frame_time
+        self.clock = clock if clock else SleepClock()
+        self.running = False
+        self._dirty = True          # нужно ли перерисовать кадр, даже если состояние не менялось
+        self._moving = False        # менялось ли состояние на последнем тике
+
+    def request_redraw(self):
+        """
+            Попросить перерисовать кадр на следующей итерации (например, после изменения размера окна)
+        """
+        self._dirty = True
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        self.running = True
+        accumulator = 0.0
+        prev_time = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            accumulator += min(now - prev_time, self.max_frame_time)
+            prev_time = now
+
+            while accumulator >= self.tick_time and self.running:
+                changed = self.update()
+                # после последнего "движущегося" тика нужно нарисовать ещё один кадр, уже в конечной позе
+                if changed or self._moving:
+                    self._dirty = True
+                self._moving = changed
+                accumulator -= self.tick_time
+            if not self.running:
+                break
+
+            if self._moving or self._dirty:
+                # сбрасываем флаг до рендера, чтобы render мог сам попросить ещё один кадр через request_redraw
+                self._dirty = False
+                self.render(accumulator / self.tick_time)
+                self.clock.tick(self.max_fps)
+            else:
+                self.clock.tick(self.idle_fps)
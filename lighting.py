@@ -0,0 +1,131 @@
+"""
+    Запекание освещения уровня.
+    Освещённость считается один раз при загрузке уровня для каждой грани каждой клетки-стены
+    (несколько отсчётов вдоль грани) и складывается в компактную таблицу байтов.
+    Во время игры рендер берёт освещённость столбца одним чтением из таблицы по точке попадания луча
+"""
+
+# грани клетки: номер, нормаль и направление, вдоль которого растёт координата u на грани
+NORTH, EAST, SOUTH, WEST = range(4)
+face_normals = ((0, -1), (1, 0), (0, 1), (-1, 0))
+face_tangents = ((1, 0), (0, 1), (1, 0), (0, 1))
+
+
+class Light:
+    """
+        Точечный источник света
+    """
+    def __init__(self, position, intensity=1.0, radius=8.0):
+        self.position = position
+        self.intensity = intensity
+        self.radius = radius    # на этом расстоянии свет затухает полностью
+
+
+class Lightmap:
+    """
+        Таблица запечённой освещённости: для каждой клетки уровня по 4 грани, для каждой грани samples отсчётов.
+        Значения хранятся байтами (0 - темнота, 255 - полная освещённость)
+    """
+    def __init__(self, width, height, samples=8, ambient=1.0):
+        self.width = width
+        self.height = height
+        self.samples = samples
+        self.ambient = ambient
+        self.values = bytearray(width * height * 4 * samples)
+        # для каждой клетки - битовая маска граней, выходящих в открытые клетки (бит номер face)
+        self.open_faces = bytearray(width * height)
+
+    def index(self, cell_x, cell_y, face):
+        return ((cell_y * self.width + cell_x) * 4 + face) * self.samples
+
+    def light_at(self, point, dir_x, dir_y):
+        """
+            Освещённость (от 0 до 1) в точке попадания луча в стену.
+            (dir_x, dir_y) - направление луча: по нему определяется грань, через которую луч вошёл в клетку
+        """
+        cell_x, cell_y = int(point.x), int(point.y)
+        if not (0 <= cell_x < self.width and 0 <= cell_y < self.height):
+            return self.ambient
+        fx, fy = point.x - cell_x, point.y - cell_y
+        # луч входит в клетку через одну из двух граней, повёрнутых к нему. Ближайшая к точке сторона не годится:
+        # луч проскакивает за грань на длину шага, и у стыка двух стен ближе оказывается грань соседней стены.
+        # Идём от точки назад вдоль луча: грань, до которой назад ближе, луч пересёк последней
+        x_face, x_depth = (WEST, fx) if dir_x > 0 else (EAST, 1 - fx)
+        y_face, y_depth = (NORTH, fy) if dir_y > 0 else (SOUTH, 1 - fy)
+        x_first = x_depth * abs(dir_y) < y_depth * abs(dir_x)
+        # шаг луча может перескочить через угол соседней стены, и тогда найденная грань закрыта - берём вторую
+        open_faces = self.open_faces[cell_y * self.width + cell_x]
+        x_open, y_open = open_faces >> x_face & 1, open_faces >> y_face & 1
+        if x_open and (x_first or not y_open):
+            face, u = x_face, fy
+        elif y_open:
+            face, u = y_face, fx
+        else:
+            # луч протиснулся между стенами по диагонали - освещённость такой точки не запекалась
+            return self.ambient
+        sample = int(u * self.samples)
+        sample = sample if sample < self.samples else self.samples - 1
+        return self.values[self.index(cell_x, cell_y, face) + sample] / 255
+
+
+def bake_lightmap(level, lights, ambient=1.0, ao_strength=0.5, samples=8, region=None, lightmap=None):
+    """
+        Запекает освещённость всех граней стен, выходящих в открытые клетки.
+        Освещённость грани = рассеянный свет с затенением углов (ambient occlusion)
+        плюс вклад каждого видимого из этой точки источника с учётом угла падения и затухания.
+        Если переданы region (x, y, ширина, высота) и уже запечённый lightmap,
+        то пересчитываются только клетки в этом прямоугольнике
+    """
+    if lightmap is None:
+        lightmap = Lightmap(level.width, level.height, samples, ambient)
+    samples = lightmap.samples
+    region_x, region_y, region_width, region_height = region if region else (0, 0, level.width, level.height)
+    is_wall = level.is_wall_cell
+
+    for cell_y in range(region_y, region_y + region_height):
+        for cell_x in range(region_x, region_x + region_width):
+            # клетка могла перестать быть стеной или её грани могли закрыться, поэтому сначала гасим все грани
+            start = lightmap.index(cell_x, cell_y, NORTH)
+            lightmap.values[start:start + 4 * samples] = bytes(4 * samples)
+            lightmap.open_faces[cell_y * level.width + cell_x] = 0
+            if not is_wall(cell_x, cell_y):
+                continue
+            for face in (NORTH, EAST, SOUTH, WEST):
+                normal_x, normal_y = face_normals[face]
+                tangent_x, tangent_y = face_tangents[face]
+                front_x, front_y = cell_x + normal_x, cell_y + normal_y
+                # грань, упирающаяся в другую стену или в край карты, никогда не видна
+                if is_wall(front_x, front_y):
+                    continue
+                lightmap.open_faces[cell_y * level.width + cell_x] |= 1 << face
+                # если рядом с клеткой перед гранью тоже стена, то в этом углу грань затеняется
+                occluded_start = is_wall(front_x - tangent_x, front_y - tangent_y)
+                occluded_end = is_wall(front_x + tangent_x, front_y + tangent_y)
+                # начало грани: угол клетки, от которого отсчитывается u
+                origin_x = cell_x + (1 if face == EAST else 0)
+                origin_y = cell_y + (1 if face == SOUTH else 0)
+
+                index = lightmap.index(cell_x, cell_y, face)
+                for sample in range(samples):
+                    u = (sample + 0.5) / samples
+                    occlusion = occluded_start * (1 - u) ** 2 + occluded_end * u ** 2
+                    light = ambient * (1 - ao_strength * min(occlusion, 1))
+
+                    # точка на грани, чуть вынесенная в открытую клетку
+                    point_x = origin_x + tangent_x * u + normal_x * 0.001
+                    point_y = origin_y + tangent_y * u + normal_y * 0.001
+                    for source in lights:
+                        to_light_x = source.position.x - point_x
+                        to_light_y = source.position.y - point_y
+                        distance = (to_light_x ** 2 + to_light_y ** 2) ** 0.5
+                        if distance >= source.radius or distance == 0:
+                            continue
+                        cos_incidence = (to_light_x * normal_x + to_light_y * normal_y) / distance
+                        if cos_incidence <= 0:
+                            continue
+                        if level.trace_segment(point_x, point_y, source.position.x, source.position.y):
+                            continue
+                        light += source.intensity * cos_incidence * (1 - distance / source.radius) ** 2
+
+                    lightmap.values[index + sample] = int(255 * min(light, 1.0))
+    return lightmap
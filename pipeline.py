@@ -0,0 +1,85 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+# копия камеры в рабочем процессе: передаётся один раз при старте,
+# дальше процессу шлём позу и уровень, только если у того поменялась revision
+_worker_camera = None
+
+
+def _init_worker(camera):
+    global _worker_camera
+    _worker_camera = camera
+
+
+def _cast_rays(level, player):
+    if level is not None:
+        _worker_camera.level = level
+    _worker_camera.player = player
+    _worker_camera.raycast()
+    return _worker_camera.z_map, _worker_camera.hits
+
+
+class PipelinedRaycaster:
+    """
+        Конвейерный расчёт лучей.
+        Пока основной процесс рисует и показывает кадр N, рабочий процесс уже считает лучи для кадра N+1.
+        Результаты приходят новыми списками и подменяют camera.z_map и camera.hits только перед отрисовкой
+        следующего кадра, поэтому рисуемый кадр никогда не видит наполовину посчитанные данные.
+        Цена — задержка картинки ровно на один кадр.
+        Расчёт лучей на чистом питоне держит GIL, поэтому работаем в отдельном процессе, а не в потоке.
+        С pipelined=False лучи считаются в основном процессе, как в обычном последовательном цикле
+    """
+    def __init__(self, camera, pipelined=True):
+        self.camera = camera
+        self.pipelined = pipelined
+        self._pending = None    # (поза, future) для расчёта, запущенного на прошлом кадре
+        self._started = False   # посчитан ли уже первый кадр
+        self._executor = None
+        # уровень и его версия, которые уже есть у рабочего процесса
+        self._sent_level, self._sent_revision = camera.level, camera.level.revision
+        if pipelined:
+            # spawn, а не fork: не тащим в рабочий процесс инициализированный SDL
+            self._executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker, initargs=(camera,))
+
+    def _submit(self, player):
+        level = self.camera.level
+        if level is not self._sent_level or level.revision != self._sent_revision:
+            self._sent_level, self._sent_revision = level, level.revision
+        else:
+            level = None
+        return player, self._executor.submit(_cast_rays, level, player)
+
+    def raycast(self, player):
+        """
+            Готовит camera.z_map и camera.hits к отрисовке кадра и выставляет camera.player в позу, для которой они посчитаны.
+            В конвейерном режиме это поза, переданная на прошлом кадре, а расчёт для player запускается в фоне.
+            Вернёт True, если картинка отстаёт от переданной позы и нужен ещё один кадр, чтобы её догнать
+        """
+        if not self.pipelined:
+            self.camera.player = player
+            self.camera.raycast()
+            return False
+
+        # на самом первом кадре показывать нечего, поэтому считаем текущую позу и ждём результат,
+        # а конвейер запустится со следующего кадра
+        if not self._started:
+            self._started = True
+            shown_player, future = self._submit(player)
+            self.camera.player = shown_player
+            self.camera.z_map, self.camera.hits = future.result()
+            return False
+
+        # на втором кадре ждать нечего: камера ещё показывает результат первого кадра
+        if self._pending is not None:
+            shown_player, future = self._pending
+            self.camera.player = shown_player
+            self.camera.z_map, self.camera.hits = future.result()
+        self._pending = self._submit(player)
+        shown_player = self.camera.player
+        return (shown_player.x, shown_player.y, shown_player.dir) != (player.x, player.y, player.dir)
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(cancel_futures=True)
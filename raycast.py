@@ -1,6 +1,10 @@
+import argparse
 import curses
 from math import *
 
+from game_loop import GameLoop
+from lighting import Light, bake_lightmap
+
 
 class Point:
     def __init__(self, x, y):
@@ -89,11 +93,101 @@ class Vector:
 
 
 class Level:
-    def __init__(self, width, height, content):
+    los_cache_size = 4096   # сколько результатов line_of_sight держать в кэше
+
+    def __init__(self, width, height, content, wall_chars='#', lights=None, ambient=1.0):
         self.width = width
         self.height = height
         self.map = content
-        self.wall_chars = '#'
+        self.wall_chars = wall_chars
+        self.lights = lights if lights else []     # точечные источники света (lighting.Light)
+        self.ambient = ambient                      # рассеянный свет
+        self.lightmap = None
+        self.bake_lighting()
+        # номер версии карты: растёт при каждом изменении через set_cell/set_region
+        self.revision = 0
+        self._subscribers = []
+        # запомненные результаты line_of_sight для неподвижных пар точек; сбрасываются при изменении уровня
+        self._los_cache = {}
+        self._los_cache_key = None
+
+    def __getstate__(self):
+        # подписчики и кэш видимости живут только в своём процессе
+        state = self.__dict__.copy()
+        state['_subscribers'] = []
+        state['_los_cache'] = {}
+        state['_los_cache_key'] = None
+        return state
+
+    def bake_lighting(self, region=None):
+        """
+            Запекаем освещение граней стен. Нужно вызвать заново, если поменялись источники света.
+            region (x, y, ширина, высота) - перезапечь только клетки в этом прямоугольнике
+        """
+        if region is None:
+            self.lightmap = bake_lightmap(self, self.lights, self.ambient)
+        else:
+            bake_lightmap(self, self.lights, self.ambient, region=region, lightmap=self.lightmap)
+
+    def subscribe(self, callback):
+        """
+            callback(level, rect) будет вызываться после каждого изменения карты;
+            rect = (x, y, ширина, высота) - прямоугольник изменившихся клеток
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def set_cell(self, x, y, cell):
+        """
+            Меняем одну клетку карты, например, открываем дверь или разрушаем стену
+        """
+        assert len(cell) == 1, f'Cell must be a single char, got {cell!r}'
+        self.set_region(x, y, [cell])
+
+    def set_region(self, x, y, rows):
+        """
+            Меняем прямоугольный участок карты с левым верхним углом в (x, y); rows - строки одинаковой длины.
+            Карта пересобирается один раз на весь участок, а подписчики получают один вызов
+            с прямоугольником только тех клеток, которые действительно изменились
+        """
+        assert rows and rows[0], f'Region must have at least one cell, got {rows!r}'
+        region_width, region_height = len(rows[0]), len(rows)
+        assert all(len(row) == region_width for row in rows), 'Region rows must have equal length'
+        assert 0 <= x and x + region_width <= self.width and 0 <= y and y + region_height <= self.height, \
+            f'Region ({x}, {y}, {region_width}, {region_height}) ' \
+            f'out of level bounds (0, 0, {self.width}, {self.height})'
+        cells = list(self.map)
+        dirty_x0, dirty_y0, dirty_x1, dirty_y1 = self.width, self.height, -1, -1
+        for row_y, row in enumerate(rows, y):
+            for cell_x, cell in enumerate(row, x):
+                index = row_y * self.width + cell_x
+                if cells[index] != cell:
+                    cells[index] = cell
+                    dirty_x0, dirty_x1 = min(dirty_x0, cell_x), max(dirty_x1, cell_x)
+                    dirty_y0, dirty_y1 = min(dirty_y0, row_y), max(dirty_y1, row_y)
+        if dirty_x1 < 0:
+            return
+
+        self.map = ''.join(cells)
+        self.revision += 1
+        rect = (dirty_x0, dirty_y0, dirty_x1 - dirty_x0 + 1, dirty_y1 - dirty_y0 + 1)
+        self._relight(rect)
+        for callback in list(self._subscribers):
+            callback(self, rect)
+
+    def _relight(self, rect):
+        """
+            Перезапекаем освещение вокруг изменившихся клеток.
+            Стена может бросать тень на грани не дальше радиуса источника от себя,
+            а на затенение углов и видимость граней влияет только соседняя клетка
+        """
+        margin = 1 + ceil(max((light.radius for light in self.lights), default=0))
+        x0, y0 = max(rect[0] - margin, 0), max(rect[1] - margin, 0)
+        x1 = min(rect[0] + rect[2] + margin, self.width)
+        y1 = min(rect[1] + rect[3] + margin, self.height)
+        self.bake_lighting((x0, y0, x1 - x0, y1 - y0))
 
     def get_row(self, row):
         assert 0 <= row < self.height, f'Row {row} out of level bounds (0, {self.height})'
@@ -119,6 +213,76 @@ class Level:
         except AssertionError:
             return True
 
+    def is_wall_cell(self, cell_x, cell_y):
+        if not (0 <= cell_x < self.width and 0 <= cell_y < self.height):
+            return True
+        return self.map[cell_y * self.width + cell_x] in self.wall_chars
+
+    def trace_segment(self, x0, y0, x1, y1):
+        """
+            Проходим по клеткам сетки от (x0, y0) до (x1, y1) по алгоритму DDA: ровно по одной проверке на клетку,
+            без шагов фиксированной длины и без создания векторов.
+            Вернёт (доля пройденного отрезка, (x, y) клетки) для первой стены на пути либо None, если путь свободен
+        """
+        cell_x, cell_y = floor(x0), floor(y0)
+        end_x, end_y = floor(x1), floor(y1)
+        if self.is_wall_cell(cell_x, cell_y):
+            return 0.0, (cell_x, cell_y)
+        dx, dy = x1 - x0, y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # доля отрезка, за которую он пересекает одну клетку по каждой оси, и доля до первой границы клеток
+        delta_x = abs(1 / dx) if dx else inf
+        delta_y = abs(1 / dy) if dy else inf
+        next_x = ((cell_x + 1 - x0) if dx > 0 else (x0 - cell_x)) * delta_x if dx else inf
+        next_y = ((cell_y + 1 - y0) if dy > 0 else (y0 - cell_y)) * delta_y if dy else inf
+        while cell_x != end_x or cell_y != end_y:
+            if next_x < next_y:
+                passed = next_x
+                cell_x += step_x
+                next_x += delta_x
+            else:
+                passed = next_y
+                cell_y += step_y
+                next_y += delta_y
+            if passed > 1:
+                break
+            if self.is_wall_cell(cell_x, cell_y):
+                return passed, (cell_x, cell_y)
+        return None
+
+    def line_of_sight(self, pairs, cache=False):
+        """
+            Пакетная проверка видимости для множества пар (откуда, куда) за один вызов,
+            например для проверок прямой видимости NPC или попаданий hitscan-оружия.
+            Точки - Point (или любой объект с x и y) либо пары чисел; pairs может быть и numpy-массивом формы (N, 2, 2).
+            Вернёт три списка: видна ли цель, расстояние до цели (или до первой стены на пути),
+            клетка этой стены (или None).
+            С cache=True результаты запоминаются и переиспользуются, пока не изменится revision уровня, -
+            это имеет смысл для неподвижных пар (турели, камеры наблюдения и т.п.)
+        """
+        if self._los_cache_key != (self.revision, self.wall_chars):
+            self._los_cache = {}
+            self._los_cache_key = (self.revision, self.wall_chars)
+        visible, distances, hit_cells = [], [], []
+        for origin, target in pairs:
+            x0, y0 = (origin.x, origin.y) if hasattr(origin, 'x') else origin
+            x1, y1 = (target.x, target.y) if hasattr(target, 'x') else target
+            key = (x0, y0, x1, y1)
+            result = self._los_cache.get(key) if cache else None
+            if result is None:
+                length = hypot(x1 - x0, y1 - y0)
+                hit = self.trace_segment(x0, y0, x1, y1)
+                result = (True, length, None) if hit is None else (False, hit[0] * length, hit[1])
+                if cache:
+                    if len(self._los_cache) >= self.los_cache_size:
+                        self._los_cache.clear()
+                    self._los_cache[key] = result
+            visible.append(result[0])
+            distances.append(result[1])
+            hit_cells.append(result[2])
+        return visible, distances, hit_cells
+
 
 class Player:
     def __init__(self, position, direction, speed=1, turn_step=5):
@@ -169,6 +333,45 @@ class Player:
         arrow_number = (self.dir + 22.5) // 45
         return '→↘↓↙←↖↑↗→'[int(arrow_number)]
 
+    def copy(self):
+        return Player(Point(self.x, self.y), self.dir, self.speed, self.turn_step)
+
+    def interpolate(self, other, alpha):
+        """
+            Вернёт нового игрока, поза которого лежит между позой self (alpha = 0) и other (alpha = 1).
+            Направление поворачиваем по кратчайшей дуге, чтобы при переходе через 0° камера не крутилась назад
+        """
+        turn = (other.dir - self.dir + 180) % 360 - 180
+        return Player(Point(self.x + (other.x - self.x) * alpha, self.y + (other.y - self.y) * alpha),
+                      self.dir + turn * alpha, self.speed, self.turn_step)
+
+
+def apply_actions(player, level, actions):
+    """
+        Применяем к игроку команды управления за один тик симуляции.
+        actions - множество из 'forward', 'back', 'left', 'right'.
+        Вернёт True, если поза игрока изменилась
+    """
+    old_pose = (player.x, player.y, player.dir)
+    if 'forward' in actions:
+        player.move_forward()
+        # если упёрлись в стену, то откатываем шаг
+        # TODO Дописать условие, при котором игрок не перепрыгнет через стену
+        #  (проверка нахождения игрока за полем или перелёт через стену).
+        #  По идее надо написать метод для бросания одного луча и заюзать его для этого
+        if level.is_wall(player.position):
+            player.move_back()
+    if 'back' in actions:
+        player.move_back()
+        # если упёрлись в стену, то откатываем шаг
+        if level.is_wall(player.position):
+            player.move_forward()
+    if 'right' in actions:
+        player.turn_right()
+    if 'left' in actions:
+        player.turn_left()
+    return (player.x, player.y, player.dir) != old_pose
+
 
 class Camera:
     def __init__(self, viewport_width, viewport_height, fov=60, depth=21.0):
@@ -178,6 +381,7 @@ class Camera:
         self.z_map = []
         self.edges = []
         self.hits = []
+        self.light_levels = []  # запечённая освещённость стены для каждого столбца
 
     def cast_single_ray(self, level, origin, ray_angle, target='#EWSBM', depth=None):
         """
@@ -231,6 +435,7 @@ class Camera:
         self.z_map = []
         self.edges = []
         self.hits = []
+        self.light_levels = []
         prev_dist = None
         for x in range(0, self.vp_width):
             ray_angle = player.dir - (self.fov / 2) + (x / self.vp_width) * self.fov
@@ -270,6 +475,7 @@ class Camera:
             distance_to_wall = distance_to_wall if distance_to_wall > 1 else 1
             self.hits.append(current_ray)
             self.z_map.append(distance_to_wall)
+            self.light_levels.append(level.lightmap.light_at(current_ray.end_point, current_ray.cos, current_ray.sin))
 
     @staticmethod
     def clear_viewport(screen):
@@ -279,17 +485,22 @@ class Camera:
         y_top, y_bot = self.get_column_coords(x)
         y_top = 0 if y_top < 0 else y_top
         y_bot = self.vp_height - 1 if y_bot > self.vp_height - 1 else y_bot
+        # освещённость стены работает как поправка к расстоянию: чем темнее стена, тем "дальше" она выглядит,
+        # но стена в зоне видимости не должна пропадать совсем
+        shade_dist = self.z_map[x]
+        if shade_dist < self.depth:
+            shade_dist = min(shade_dist / max(self.light_levels[x], 0.01), self.depth - 0.01)
         # если x есть в списке с гранями и находится в зоне видимости, то вместо стены будем рисовать эту грань
         if x in self.edges and self.z_map[x] < self.depth:
             wall_char = '|'
         # "красим" стену в зависимости от расстояния до неё
-        elif self.z_map[x] <= self.depth / 3:
+        elif shade_dist <= self.depth / 3:
             wall_char = '█'
-        elif self.z_map[x] < self.depth / 2:
+        elif shade_dist < self.depth / 2:
             wall_char = '▓'
-        elif self.z_map[x] < self.depth / 1.5:
+        elif shade_dist < self.depth / 1.5:
             wall_char = '▒'
-        elif self.z_map[x] < self.depth:
+        elif shade_dist < self.depth:
             wall_char = '░'
         else:
             wall_char = ' '
@@ -340,61 +551,91 @@ def draw_minimap(screen, position, player, level):
     screen.addstr(int(player.y) + position.y, int(player.x) + position.x, player.get_dir_arrow())
 
 
-def main_game(screen):
+# карта уровня
+map_height = 16
+map_width = 25
+lvl_map = ("#########################"
+           "#.......................#"
+           "#....#########..........#"
+           "#............#..........#"
+           "#............#..........#"
+           "#............#..........#"
+           "#............#####......#"
+           "#....###................#"
+           "#....###.....#......##..#"
+           "#............#......##..#"
+           "#............#..........#"
+           "#............#..........#"
+           "#........########.......#"
+           "#.......................#"
+           "#.......................#"
+           "#########################").replace('.', ' ')
+# источники света и рассеянный свет уровня
+lvl_lights = [Light(Point(7.5, 5.5)), Light(Point(18.5, 4.5)), Light(Point(10.5, 13.5), intensity=0.8)]
+lvl_ambient = 0.45
+
+# соответствие клавиш командам управления
+key_actions = {ord('w'): 'forward', ord('s'): 'back', ord('d'): 'right', ord('a'): 'left'}
+tick_rate = 30
+
+
+def create_player():
+    return Player(Point(2.0, 1.0), 90.0)
+
+
+def draw_frame(screen, camera, player, level):
+    """
+        Рисуем один кадр: стены, миникарту и строку с позой игрока
+    """
+    camera.raycast(player, level)
+    camera.clear_viewport(screen)
+    camera.render_viewport(screen)
+
+    draw_minimap(screen, Point(0, 1), player, level)
+    screen.addstr(0, 0, f'x={player.x: 6.2f} y={player.y: 6.2f} dir={player.dir:>5}')
+
+
+def main_game(screen, record_path=None):
     viewport_width = curses.COLS
     viewport_height = curses.LINES
-    key = 0
-    level = Level(map_width, map_height, lvl_map)
-    player = Player(Point(2.0, 1.0), 90.0)
+    level = Level(map_width, map_height, lvl_map, lights=lvl_lights, ambient=lvl_ambient)
+    player = create_player()
+    prev_player = player.copy()     # поза на предыдущем тике, нужна для интерполяции при рендере
     camera = Camera(viewport_width, viewport_height)
-
-    while True:  # игровой цикл
-        if key == ord('w'):
-            player.move_forward()
-            # если упёрлись в стену, то откатываем шаг
-            # TODO Дописать условие, при котором игрок не перепрыгнет через стену
-            #  (проверка нахождения игрока за полем или перелёт через стену).
-            #  По идее надо написать метод для бросания одного луча и заюзать его для этого
-            if level.is_wall(player.position):
-                player.move_back()
-        elif key == ord('s'):
-            player.move_back()
-            # если упёрлись в стену, то откатываем шаг
-            if level.is_wall(player.position):
-                player.move_forward()
-        elif key == ord('d'):
-            player.turn_right()
-        elif key == ord('a'):
-            player.turn_left()
-
-        camera.raycast(player, level)
-        camera.clear_viewport(screen)
-        camera.render_viewport(screen)
-
-        draw_minimap(screen, Point(0, 1), player, level)
-        screen.addstr(0, 0, f'x={player.x: 6.2f} y={player.y: 6.2f} dir={player.dir:>5}')
+    # getch больше не блокирует цикл: ожиданием теперь управляет игровой цикл
+    screen.nodelay(True)
+    recorder = None
+    if record_path:
+        from replay import InputRecorder
+        recorder = InputRecorder(record_path, 'curses', (viewport_width, viewport_height), player, tick_rate)
+
+    def update():
+        nonlocal prev_player
+        prev_player = player.copy()
+        actions = set()
         key = screen.getch()
+        while key != -1:
+            if key in key_actions:
+                actions.add(key_actions[key])
+            key = screen.getch()
+        changed = apply_actions(player, level, actions)
+        if recorder:
+            recorder.record(actions, player)
+        return changed
+
+    def render(alpha):
+        draw_frame(screen, camera, prev_player.interpolate(player, alpha), level)
+        screen.refresh()
+
+    try:
+        GameLoop(update, render, tick_rate=tick_rate, max_fps=30).run()
+    finally:
+        if recorder:
+            recorder.close()
 
 
 if __name__ == '__main__':
-    # карта уровня
-    map_height = 16
-    map_width = 25
-    lvl_map = ("#########################"
-               "#.......................#"
-               "#....#########..........#"
-               "#............#..........#"
-               "#............#..........#"
-               "#............#..........#"
-               "#............#####......#"
-               "#....###................#"
-               "#....###.....#......##..#"
-               "#............#......##..#"
-               "#............#..........#"
-               "#............#..........#"
-               "#........########.......#"
-               "#.......................#"
-               "#.......................#"
-               "#########################").replace('.', ' ')
-
-    curses.wrapper(main_game)
+    parser = argparse.ArgumentParser(description='Консольная демка рейкастинга')
+    parser.add_argument('--record', metavar='PATH', help='записать ввод и позы игрока для последующего replay.py')
+    args = parser.parse_args()
+    curses.wrapper(main_game, args.record)
@@ -1,8 +1,11 @@
+import argparse
 import math
 import os
 import raycast
 import pygame
 from pygame import locals as pgl
+from game_loop import GameLoop
+from pipeline import PipelinedRaycaster
 
 
 # карта уровня
@@ -24,6 +27,19 @@ map_content = ("#########################"
                "#.......................#"
                "#.......................#"
                "#########################").replace('.', ' ')
+# источники света и рассеянный свет уровня
+lights = [raycast.Light(raycast.Point(7.5, 5.5)), raycast.Light(raycast.Point(18.5, 4.5)),
+          raycast.Light(raycast.Point(10.5, 13.5), intensity=0.8)]
+ambient = 0.45
+
+# текстуры стен для символов карты (пробел - для лучей, не нашедших стену)
+texture_files = {'#': 'redbrick.png', ' ': 'redbrick.png', 'E': 'eagle.png', 'W': 'wood.png',
+                 'S': 'greystone.png', 'B': 'bluestone.png', 'M': 'slimestone.png'}
+
+# соответствие клавиш командам управления
+key_actions = {pgl.K_w: 'forward', pgl.K_s: 'back', pgl.K_d: 'right', pgl.K_a: 'left'}
+resolution = (480, 360)
+tick_rate = 30
 
 
 class PGCamera:
@@ -32,7 +48,7 @@ class PGCamera:
         Из-за большого количества изменений (по сравнению с консольной версией) практически во всех методах,
         оказалось проще не наследоваться, а создать новый класс на основе консольного
     """
-    def __init__(self, screen, level, player, fov=60, depth=21.0):
+    def __init__(self, screen, level, player, fov=60, depth=21.0, mipmaps=False):
         # привязываем камеру к экрану, уровню и игроку для более удобной работы
         self._screen = screen
         self.level = level
@@ -44,14 +60,16 @@ class PGCamera:
         self.hits = []      # "сырые" векторы, полученные рейкастингом
 
         # подгружаем используемые текстуры
-        self.textures = {
-            '#': pygame.image.load(os.path.join('assets', 'redbrick.png')).convert(),
-            ' ': pygame.image.load(os.path.join('assets', 'redbrick.png')).convert(),
-            'E': pygame.image.load(os.path.join('assets', 'eagle.png')).convert(),
-            'W': pygame.image.load(os.path.join('assets', 'wood.png')).convert(),
-            'S': pygame.image.load(os.path.join('assets', 'greystone.png')).convert(),
-            'B': pygame.image.load(os.path.join('assets', 'bluestone.png')).convert(),
-            'M': pygame.image.load(os.path.join('assets', 'slimestone.png')).convert(), }
+        self.textures = {cell: pygame.image.load(os.path.join('assets', file_name)).convert()
+                         for cell, file_name in texture_files.items()}
+        # для каждой текстуры строим цепочку уменьшенных копий (мип-уровней), каждая вдвое меньше предыдущей.
+        # Далёкая стена высотой в несколько пикселей берёт столбец из маленькой копии: это дешевле,
+        # а усреднение при уменьшении убирает мерцание текстуры вдали.
+        # По умолчанию выключено: на штатных текстурах 64x64 выигрыша по времени нет (см. bench_mipmap.py),
+        # он появляется только на текстурах высокого разрешения
+        self.mipmaps = mipmaps
+        self.texture_mips = {cell: self.build_mips(texture) if mipmaps else [texture]
+                             for cell, texture in self.textures.items()}
 
         # подгружаем текстуру для скайбокса
         # и изменяем её размер так, чтобы её высота равнялась высоте окна (с сохранением пропорций)
@@ -61,6 +79,21 @@ class PGCamera:
         bg_width = int(self.bg_texture.get_width() * bg_scale_factor)
         self.bg_texture = pygame.transform.scale(self.bg_texture, (bg_width, bg_height))
 
+    def __getstate__(self):
+        # поверхности pygame не сериализуются, а для расчёта лучей в другом процессе они и не нужны
+        state = self.__dict__.copy()
+        for key in ('_screen', 'textures', 'texture_mips', 'bg_texture'):
+            del state[key]
+        return state
+
+    @staticmethod
+    def build_mips(texture):
+        mips = [texture]
+        while mips[-1].get_width() > 1 and mips[-1].get_height() > 1:
+            width, height = mips[-1].get_size()
+            mips.append(pygame.transform.smoothscale(mips[-1], (width // 2, height // 2)))
+        return mips
+
     @property
     def screen(self):
         return self._screen
@@ -172,7 +205,14 @@ class PGCamera:
         # находим верхнюю и нижнюю ординаты (это не ошибка) стены
         y_top, y_bot = self.get_column_coords(x)
         # берём текстуру, соответствующую блоку, в который попал луч
-        texture = self.textures[self.level.get_cell(self.hits[x].end_point)]
+        # (нулевой мип-уровень - сама текстура; без мип-уровней он единственный)
+        mips = self.texture_mips[self.level.get_cell(self.hits[x].end_point)]
+        texture = mips[0]
+        # а если столбец ниже текстуры - самый маленький мип-уровень, который ещё не ниже столбца на экране
+        # (у очень далёкой стены высота столбца может округлиться до нуля)
+        if len(mips) > 1 and y_bot - y_top < texture.get_height():
+            mip_level = (texture.get_height() // max(y_bot - y_top, 1)).bit_length() - 1
+            texture = mips[min(mip_level, len(mips) - 1)]
 
         # а теперь немного магии с текстурами:
         # поскольку в пределах одной ячейки карты попадает сразу несколько лучей,
@@ -196,9 +236,12 @@ class PGCamera:
         # чтобы было красивее, затеним участки стены: чем дальше от игрока, тем сильнее затемнение.
         # Просто поверх уже нарисованной полоски текстуры рисуем чёрную полоску в 1 пиксель,
         # прозрачность которой и будем регулировать: чем дальше от игрока,
-        # тем больше байт прозрачности (то есть прозрачность меньше, а затемнение бильнее)
-        transparency = int(255 * (self.z_map[x] / self.depth))
-        transparency = transparency if transparency <= 255 else 255
+        # тем больше байт прозрачности (то есть прозрачность меньше, а затемнение бильнее).
+        # Запечённая освещённость стены (одно чтение из таблицы) ослабляет то, что осталось видно после затухания
+        distance_factor = self.z_map[x] / self.depth
+        distance_factor = distance_factor if distance_factor <= 1 else 1
+        light = self.level.lightmap.light_at(self.hits[x].end_point, self.hits[x].cos, self.hits[x].sin)
+        transparency = int(255 * (1 - (1 - distance_factor) * light))
         shadow = pygame.Surface((1, y_bot - y_top), pygame.SRCALPHA)
         shadow.fill((0, 0, 0, transparency))
         self._screen.blit(shadow, rect)
@@ -260,31 +303,57 @@ class Interface:
                                                   (int(hud_texture.get_width() * hud_scale_factor),
                                                    int(hud_texture.get_height() * hud_scale_factor)))
         self.frame = self._prepare_frame()
+        # миникарта и шрифты для неё готовятся при первом выводе
+        self._minimap = None
+        self._minimap_level = None
+        self._minimap_font = None
+        self._minimap_arrow_font = None
+        self._minimap_dirty_rows = set()
 
     def clear_viewport(self):
         self.screen.fill((0, 0, 0, 0))
 
+    def _on_level_changed(self, level, rect):
+        # запоминаем изменившиеся строки карты, перерисуем их при следующем выводе миникарты
+        self._minimap_dirty_rows.update(range(rect[1], rect[1] + rect[3]))
+
+    def _update_minimap(self):
+        """
+            Миникарта рисуется на отдельной поверхности один раз,
+            а после изменений уровня перерисовываются только изменившиеся строки
+        """
+        level = self.camera.level
+        if self._minimap_level is not level:
+            if self._minimap_level is not None:
+                self._minimap_level.unsubscribe(self._on_level_changed)
+            level.subscribe(self._on_level_changed)
+            self._minimap_level = level
+            self._minimap_font = pygame.font.SysFont('Courier New', 12)
+            self._minimap_arrow_font = pygame.font.Font(
+                os.path.join('assets', 'Meslo LG M Regular for Powerline.ttf'), 12)
+            font_size = self._minimap_font.size('#')
+            self._minimap = pygame.Surface((font_size[0] * level.width, font_size[1] * level.height), pygame.SRCALPHA)
+            self._minimap_dirty_rows = set(range(level.height))
+
+        row_height = self._minimap_font.size('#')[1]
+        transparency = 128
+        for y in self._minimap_dirty_rows:
+            self._minimap.fill((0, 0, 0, transparency), (0, row_height * y, self._minimap.get_width(), row_height))
+            self._minimap.blit(self._minimap_font.render(level.get_row(y), 0, (255, 255, 255)), (0, row_height * y))
+        self._minimap_dirty_rows.clear()
+
     def draw_minimap(self, position):
         """
             Вывод миникарты
         """
+        self._update_minimap()
         player = self.camera.player
-        level = self.camera.level
-        font = pygame.font.SysFont('Courier New', 12)
-        arrow_font = pygame.font.Font(os.path.join('assets', 'Meslo LG M Regular for Powerline.ttf'), 12)
-        font_size = font.size('#')
-        transparency = 128
-        text_bg = pygame.Surface((font_size[0] * level.width, font_size[1] * level.height), pygame.SRCALPHA)
-        text_bg.fill((0, 0, 0, transparency))
-        rect = text_bg.get_rect()
+        font_size = self._minimap_font.size('#')
+        rect = self._minimap.get_rect()
         rect = rect.move((position.x, position.y))
-        self.screen.blit(text_bg, rect)
-
-        for y in range(0, level.height):
-            self.screen.blit(font.render(level.get_row(y), 0,
-                                         (255, 255, 255)), (position.x, position.y + font_size[1] * y))
+        self.screen.blit(self._minimap, rect)
 
-        self.screen.blit(arrow_font.render(player.get_dir_arrow(), 0, (255, 255, 255)),
+        self.screen.blit(self._minimap_arrow_font.render(player.get_dir_arrow(), 0, (255, 255, 255)),
                          (position.x + int(player.x) * font_size[0], position.y + int(player.y) * font_size[1]))
 
     def draw_rays_fixed(self, position, scale=7, transparency=128):
@@ -375,59 +444,112 @@ def get_root_screen(resolution):
     return screen
 
 
-def main_game():
-    root_screen = get_root_screen((480, 360))
-    game_screen = pygame.Surface((480, 360))
-    interface_screen = pygame.Surface((480, 360), pygame.SRCALPHA)
+def build_scene(root_screen, level=None):
+    """
+        Создаём уровень (если он не передан), игрока, камеру и интерфейс под размер корневого экрана
+    """
+    width, height = root_screen.get_size()
+    game_screen = pygame.Surface((width, height))
+    interface_screen = pygame.Surface((width, height), pygame.SRCALPHA)
 
-    level = raycast.Level(*map_size, map_content)
-    level.wall_chars = wall_chars
-    player = raycast.Player(raycast.Point(2.0, 2.0), 45.0)
+    if level is None:
+        level = raycast.Level(*map_size, map_content, wall_chars=wall_chars, lights=lights, ambient=ambient)
+    player = create_player()
     camera = PGCamera(game_screen, level, player, fov=60)
     interface = Interface(interface_screen, camera)
     # уменьшим игровой экран на высоту интерфейса,
     # чтобы сместить центр игрового экрана в середину свободной от интерфейса области
-    game_screen = pygame.Surface((480, 360 - interface.hud_texture.get_height()))
-    camera.screen = game_screen
+    camera.screen = pygame.Surface((width, height - interface.hud_texture.get_height()))
+    return level, player, camera, interface
 
-    while True:  # игровой цикл
-        # реагируем на клавиатуру
+
+def create_player():
+    # скорость задаётся за один тик симуляции: при 30 тиках в секунду это 3 клетки и 90° в секунду
+    return raycast.Player(raycast.Point(2.0, 2.0), 45.0, speed=0.1, turn_step=3)
+
+
+def draw_frame(root_screen, camera, interface):
+    """
+        Рисуем один кадр для текущей позы camera.player и накладываем его на корневой экран
+    """
+    # считаем расстояния
+    camera.raycast()
+    compose_frame(root_screen, camera, interface)
+
+
+def compose_frame(root_screen, camera, interface):
+    """
+        Рисуем кадр по уже посчитанным camera.z_map и camera.hits
+    """
+    # очищаем игровой и интерфейсный экраны
+    camera.clear_viewport()
+    interface.clear_viewport()
+
+    # рендерим игру, основной интерфейс и дополнительные вещи
+    camera.render_viewport()
+    interface.draw_hud()
+    # interface.draw_minimap(fps.Point(0, 0))
+    interface.draw_rays_fixed(raycast.Point(camera.vp_width // 2 + 100, camera.vp_height // 2 + 100))
+
+    # накладываем игровой и интерфейсный экраны на основной
+    root_screen.blit(camera.screen, camera.screen.get_rect())
+    root_screen.blit(interface.screen, interface.screen.get_rect())
+
+
+def main_game(record_path=None, pipelined=None):
+    root_screen = get_root_screen(resolution)
+    level, player, camera, interface = build_scene(root_screen)
+    # на одном ядре конвейер только добавит расходы на пересылку данных между процессами
+    pipelined = pipelined if pipelined is not None else (os.cpu_count() or 1) > 1
+    raycaster = PipelinedRaycaster(camera, pipelined)
+    prev_player = player.copy()     # поза на предыдущем тике, нужна для интерполяции при рендере
+    loop = None
+    recorder = None
+    if record_path:
+        from replay import InputRecorder
+        recorder = InputRecorder(record_path, 'pygame', resolution, player, tick_rate)
+
+    def update():
+        nonlocal prev_player
+        prev_player = player.copy()
+        # реагируем на события окна
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                pygame.quit()
+                loop.stop()
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                loop.request_redraw()
 
+        # реагируем на клавиатуру
         keys = pygame.key.get_pressed()
-        if keys[pgl.K_w]:
-            player.move_forward()
-            if level.is_wall(player.position):
-                player.move_back()
-        if keys[pgl.K_s]:
-            player.move_back()
-            # если упёрлись в стену, то откатываем шаг
-            if level.is_wall(player.position):
-                player.move_forward()
-        if keys[pgl.K_d]:
-            player.turn_right()
-        if keys[pgl.K_a]:
-            player.turn_left()
-
-        # считаем расстояния
-        camera.raycast()
-        # очищаем игровой и интерфейсный экраны
-        camera.clear_viewport()
-        interface.clear_viewport()
-
-        # рендерим игру, основной интерфейс и дополнительные вещи
-        camera.render_viewport()
-        interface.draw_hud()
-        # interface.draw_minimap(fps.Point(0, 0))
-        interface.draw_rays_fixed(raycast.Point(camera.vp_width // 2 + 100, camera.vp_height // 2 + 100))
-
-        # накладываем игровой и интерфейсный экраны на основной и показываем игроку
-        root_screen.blit(game_screen, game_screen.get_rect())
-        root_screen.blit(interface_screen, interface_screen.get_rect())
+        actions = {action for key, action in key_actions.items() if keys[key]}
+        changed = raycast.apply_actions(player, level, actions)
+        if recorder:
+            recorder.record(actions, player)
+        return changed
+
+    def render(alpha):
+        # рисуем игрока в промежуточной позе между двумя тиками симуляции.
+        # В конвейерном режиме на экран попадёт поза с прошлого кадра, а эта посчитается в фоне,
+        # поэтому, пока картинка отстаёт от симуляции, просим цикл перерисовать кадр ещё раз
+        if raycaster.raycast(prev_player.interpolate(player, alpha)):
+            loop.request_redraw()
+        compose_frame(root_screen, camera, interface)
         pygame.display.flip()
 
+    loop = GameLoop(update, render, tick_rate=tick_rate, max_fps=60, clock=pygame.time.Clock())
+    try:
+        loop.run()
+    finally:
+        if recorder:
+            recorder.close()
+        raycaster.close()
+        pygame.quit()
+
 
 if __name__ == '__main__':
-    main_game()
+    parser = argparse.ArgumentParser(description='Графическая демка рейкастинга на pygame')
+    parser.add_argument('--record', metavar='PATH', help='записать ввод и позы игрока для последующего replay.py')
+    parser.add_argument('--serial', action='store_true',
+                        help='считать лучи в основном потоке, без конвейера (кадр на экране без задержки)')
+    args = parser.parse_args()
+    main_game(args.record, pipelined=False if args.serial else None)
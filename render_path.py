@@ -0,0 +1,248 @@
+"""
+    Пакетный рендер пролёта камеры без окна: каждый кадр рисуется через PGCamera и Interface
+    с максимальной скоростью на SDL-драйвере dummy.
+
+    Путь камеры - JSON-список ключевых поз, между которыми поза интерполируется:
+        [{"t": 0, "x": 2.0, "y": 2.0, "dir": 45}, {"t": 4, "x": 10.5, "y": 1.5, "dir": 0}, ...]
+    (t - время в секундах). Уровень по умолчанию берётся из графической демки, но можно передать свой JSON:
+        {"map": ["#####", "#   #", ...], "wall_chars": "#", "ambient": 1.0,
+         "lights": [{"x": 2.5, "y": 1.5, "intensity": 1.0, "radius": 8.0}]}
+    Стенами могут быть только символы, для которых у PGCamera есть текстуры: # E W S B M
+
+    Кадры пишутся по порядку: сырым RGB в stdout или файл/канал (удобно отдавать в ffmpeg)
+    либо последовательностью PNG или NPY в каталог. В памяти одновременно держится не больше
+    нескольких кадров на рабочий процесс, поэтому длина ролика на расход памяти не влияет.
+
+        python render_path.py path.json --format raw | \\
+            ffmpeg -f rawvideo -pix_fmt rgb24 -s 480x360 -r 30 -i - raycasting_pygame.webm
+        python render_path.py path.json --format png --output frames --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# рендерим без окна, а приветствие pygame не должно попасть в поток кадров в stdout
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+import raycast
+import raycast_pygame_demo as demo
+
+
+# сцена рабочего процесса: создаётся один раз при старте, дальше процессу шлём только номер кадра и позу
+_scene = None
+
+
+class FrameRenderer:
+    """
+        Рисует кадры для заданных поз на невидимом экране
+    """
+    def __init__(self, resolution, level=None):
+        self.root_screen = demo.get_root_screen(resolution)
+        _, _, self.camera, self.interface = demo.build_scene(self.root_screen, level)
+
+    def render(self, player):
+        """
+            Вернёт кадр в виде байтов RGB
+        """
+        self.camera.player = player
+        demo.draw_frame(self.root_screen, self.camera, self.interface)
+        return pygame.image.tobytes(self.root_screen, 'RGB')
+
+    def save_png(self, player, path):
+        self.camera.player = player
+        demo.draw_frame(self.root_screen, self.camera, self.interface)
+        pygame.image.save(self.root_screen, path)
+
+
+def _init_worker(resolution, level):
+    global _scene
+    _scene = FrameRenderer(resolution, level)
+
+
+def _render_frame(player, png_path=None):
+    if png_path:
+        _scene.save_png(player, png_path)
+        return None
+    return _scene.render(player)
+
+
+def load_level(path):
+    with open(path, encoding='utf-8') as level_file:
+        description = json.load(level_file)
+    rows = description['map']
+    wall_chars = description.get('wall_chars', '#')
+    # пробел - это пустое место, стеной он быть не может
+    allowed = set(demo.texture_files) - {' '}
+    unknown = sorted(set(wall_chars) - allowed)
+    if unknown:
+        raise ValueError(f'Level {path}: no textures for wall chars {unknown}, allowed: {"".join(sorted(allowed))}')
+    # дальше проверяем то, на чём рендер иначе упадёт посреди ролика
+    if not rows or not rows[0]:
+        raise ValueError(f'Level {path}: map is empty')
+    if any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError(f'Level {path}: map rows must have equal length {len(rows[0])}, '
+                         f'got {sorted(set(len(row) for row in rows))}')
+    for y, row in enumerate(rows):
+        stray = sorted(set(row) - set(wall_chars) - {' '})
+        if stray:
+            raise ValueError(f'Level {path}: row {y} has chars {stray} that are neither walls nor space')
+    # луч, ушедший в дыру в границе, выходит за пределы карты
+    border = [(x, 0) for x in range(len(rows[0]))] + [(x, len(rows) - 1) for x in range(len(rows[0]))] + \
+             [(0, y) for y in range(len(rows))] + [(len(rows[0]) - 1, y) for y in range(len(rows))]
+    holes = sorted(set((x, y) for x, y in border if rows[y][x] not in wall_chars))
+    if holes:
+        raise ValueError(f'Level {path}: map border must be walls, open cells at {holes[:5]}')
+    lights = [raycast.Light(raycast.Point(light['x'], light['y']),
+                            light.get('intensity', 1.0), light.get('radius', 8.0))
+              for light in description.get('lights', [])]
+    return raycast.Level(len(rows[0]), len(rows), ''.join(rows), wall_chars,
+                         lights, description.get('ambient', 1.0))
+
+
+def load_keyframes(path, level_size=demo.map_size):
+    with open(path, encoding='utf-8') as path_file:
+        keyframes = json.load(path_file)
+    assert len(keyframes) >= 1, f'Camera path {path} has no keyframes'
+    # уровень прямоугольный, поэтому если внутри лежат ключевые позы, то и весь путь между ними
+    width, height = level_size
+    outside = [(keyframe['x'], keyframe['y']) for keyframe in keyframes
+               if not (0 < keyframe['x'] < width and 0 < keyframe['y'] < height)]
+    if outside:
+        raise ValueError(f'Camera path {path}: keyframes {outside} are outside the {width}x{height} level')
+    keyframes.sort(key=lambda keyframe: keyframe['t'])
+    return keyframes
+
+
+def path_poses(keyframes, fps):
+    """
+        По очереди отдаёт позы камеры для каждого кадра: между соседними ключевыми позами
+        положение интерполируется линейно, а направление - по кратчайшей дуге
+    """
+    players = [raycast.Player(raycast.Point(keyframe['x'], keyframe['y']), keyframe['dir']) for keyframe in keyframes]
+    duration = keyframes[-1]['t'] - keyframes[0]['t']
+    segment = 0
+    for frame in range(int(duration * fps) + 1):
+        t = keyframes[0]['t'] + frame / fps
+        while segment < len(keyframes) - 2 and t > keyframes[segment + 1]['t']:
+            segment += 1
+        if len(keyframes) == 1:
+            yield players[0].copy()
+            continue
+        start, end = keyframes[segment]['t'], keyframes[segment + 1]['t']
+        alpha = (t - start) / (end - start) if end > start else 1.0
+        yield players[segment].interpolate(players[segment + 1], min(alpha, 1.0))
+
+
+def npy_header(width, height):
+    """
+        Заголовок формата .npy для кадра uint8 формы (height, width, 3), чтобы не зависеть от numpy
+    """
+    header = "{'descr': '|u1', 'fortran_order': False, 'shape': (%d, %d, 3), }" % (height, width)
+    # магия, версия 1.0, длина заголовка; весь заголовок выравнивается до 64 байт и заканчивается переводом строки
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = header + ' ' * padding + '\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+def render_path(poses, resolution, level=None, output_format='raw', output='-', workers=1, report_every=100):
+    """
+        Рисует кадры для всех поз и пишет их по порядку. Вернёт (количество кадров, кадров в секунду)
+    """
+    width, height = resolution
+    if output_format in ('png', 'npy'):
+        os.makedirs(output, exist_ok=True)
+    stream = None
+    if output_format == 'raw':
+        stream = sys.stdout.buffer if output == '-' else open(output, 'wb')
+
+    def frame_path(index):
+        return os.path.join(output, f'frame_{index:06d}.{output_format}')
+
+    def write(index, frame):
+        if output_format == 'raw':
+            stream.write(frame)
+        elif output_format == 'npy':
+            with open(frame_path(index), 'wb') as npy_file:
+                npy_file.write(npy_header(width, height))
+                npy_file.write(frame)
+
+    def report(count):
+        elapsed = time.perf_counter() - started
+        print(f'{count} frames, {count / elapsed:.1f} frames/sec', file=sys.stderr)
+
+    started = time.perf_counter()
+    count = 0
+    try:
+        if workers <= 1:
+            renderer = FrameRenderer(resolution, level)
+            for count, player in enumerate(poses, 1):
+                if output_format == 'png':
+                    renderer.save_png(player, frame_path(count - 1))
+                else:
+                    write(count - 1, renderer.render(player))
+                if count % report_every == 0:
+                    report(count)
+        else:
+            # держим в работе не больше двух кадров на процесс: готовые кадры сразу пишутся и освобождаются
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(resolution, level)) as executor:
+                in_flight = deque()
+                for index, player in enumerate(poses):
+                    png_path = frame_path(index) if output_format == 'png' else None
+                    in_flight.append((index, executor.submit(_render_frame, player, png_path)))
+                    if len(in_flight) >= workers * 2:
+                        done_index, future = in_flight.popleft()
+                        write(done_index, future.result())
+                        count += 1
+                        if count % report_every == 0:
+                            report(count)
+                while in_flight:
+                    done_index, future = in_flight.popleft()
+                    write(done_index, future.result())
+                    count += 1
+    finally:
+        if stream is not None:
+            stream.flush()
+            if stream is not sys.stdout.buffer:
+                stream.close()
+
+    elapsed = time.perf_counter() - started
+    return count, count / elapsed if elapsed else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пакетный рендер пролёта камеры без окна')
+    parser.add_argument('path', help='JSON с ключевыми позами камеры')
+    parser.add_argument('--level', help='JSON с уровнем (по умолчанию - уровень графической демки)')
+    parser.add_argument('--size', default='480x360', help='размер кадра, ШИРИНАxВЫСОТА')
+    parser.add_argument('--fps', type=float, default=30, help='частота кадров ролика')
+    parser.add_argument('--format', choices=('raw', 'png', 'npy'), default='raw',
+                        help='raw - поток RGB24, png и npy - последовательность файлов в каталоге')
+    parser.add_argument('--output', default='-', help='файл для raw ("-" - stdout) или каталог для png/npy')
+    parser.add_argument('--workers', type=int, default=1, help='количество процессов для рендера')
+    args = parser.parse_args()
+
+    if args.format != 'raw' and args.output == '-':
+        parser.error('--output directory is required for png and npy formats')
+    resolution = tuple(int(side) for side in args.size.lower().split('x'))
+    try:
+        level = load_level(args.level) if args.level else None
+        keyframes = load_keyframes(args.path, (level.width, level.height) if level else demo.map_size)
+    except ValueError as error:
+        parser.error(str(error))
+    poses = path_poses(keyframes, args.fps)
+    count, frames_per_sec = render_path(poses, resolution, level, args.format, args.output, args.workers)
+    print(f'Rendered {count} frames {resolution[0]}x{resolution[1]} at {frames_per_sec:.1f} frames/sec',
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
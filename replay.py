@@ -0,0 +1,251 @@
+"""
+    Запись и детерминированное воспроизведение ввода для регрессионной проверки рендера.
+
+    Демки умеют записывать лог (ключ --record): первая строка — заголовок с параметрами сцены,
+    дальше по строке на тик симуляции с командами управления и позой игрока после тика.
+    Воспроизведение (play) прогоняет лог через Camera или PGCamera без окна и пишет отчёт:
+    по строке на кадр с контрольными суммами z_map и картинки, а также данными для сравнения с допуском.
+    Сравнение (compare) проверяет два отчёта, например эталонный и полученный после оптимизации движка.
+
+        python raycast_pygame_demo.py --record session.jsonl
+        python replay.py play session.jsonl reference.jsonl
+        python replay.py play session.jsonl candidate.jsonl
+        python replay.py compare reference.jsonl candidate.jsonl --z-tolerance 0.01 --pixel-tolerance 8
+"""
+import argparse
+import base64
+import json
+import os
+import struct
+import sys
+import zlib
+
+
+class InputRecorder:
+    """
+        Пишет лог ввода: заголовок со стартовой позой и по строке на каждый тик симуляции
+    """
+    def __init__(self, path, renderer, viewport, player, tick_rate):
+        self._file = open(path, 'w', encoding='utf-8')
+        self._write({'renderer': renderer, 'viewport': list(viewport), 'tick_rate': tick_rate,
+                     'start': pose_of(player), 'speed': player.speed, 'turn_step': player.turn_step})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+
+    def record(self, actions, player):
+        self._write({'actions': sorted(actions), 'pose': pose_of(player)})
+
+    def close(self):
+        self._file.close()
+
+
+class CharBuffer:
+    """
+        Заменитель экрана curses: хранит символы в памяти, чтобы рендерить консольную камеру без терминала
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.rows = []
+        self.clear()
+
+    def clear(self):
+        self.rows = [[' '] * self.width for _ in range(self.height)]
+
+    def addstr(self, y, x, text):
+        row = self.rows[y]
+        for i, char in enumerate(text[:self.width - x]):
+            row[x + i] = char
+
+    def get_text(self):
+        return '\n'.join(''.join(row) for row in self.rows)
+
+
+def pose_of(player):
+    return [player.x, player.y, player.dir]
+
+
+def load_log(path):
+    with open(path, encoding='utf-8') as log_file:
+        records = [json.loads(line) for line in log_file if line.strip()]
+    assert records, f'Replay log {path} is empty'
+    return records[0], records[1:]
+
+
+def replay_poses(header, ticks, level, tolerance=1e-9):
+    """
+        Заново применяет записанный ввод к игроку и по очереди отдаёт его позы.
+        Если поза разошлась с записанной, значит изменилась сама симуляция, а не рендер, — сообщаем об этом сразу
+    """
+    import raycast
+    player = raycast.Player(raycast.Point(*header['start'][:2]), header['start'][2],
+                            header['speed'], header['turn_step'])
+    yield player
+    for tick, record in enumerate(ticks, 1):
+        raycast.apply_actions(player, level, set(record['actions']))
+        if any(abs(a - b) > tolerance for a, b in zip(pose_of(player), record['pose'])):
+            raise RuntimeError(f'Replay desync on tick {tick}: pose {pose_of(player)}, recorded {record["pose"]}')
+        yield player
+
+
+def z_map_checksum(z_map):
+    return zlib.crc32(struct.pack(f'{len(z_map)}d', *z_map))
+
+
+def play_curses(header, ticks):
+    import raycast
+    width, height = header['viewport']
+    level = raycast.Level(raycast.map_width, raycast.map_height, raycast.lvl_map,
+                          lights=raycast.lvl_lights, ambient=raycast.lvl_ambient)
+    camera = raycast.Camera(width, height)
+    screen = CharBuffer(width, height)
+    for tick, player in enumerate(replay_poses(header, ticks, level)):
+        raycast.draw_frame(screen, camera, player, level)
+        text = screen.get_text()
+        yield {'tick': tick, 'pose': pose_of(player),
+               'z_crc': z_map_checksum(camera.z_map), 'frame_crc': zlib.crc32(text.encode('utf-8')),
+               'z_map': camera.z_map, 'text': text}
+
+
+def play_pygame(header, ticks):
+    # рендерим без окна
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import raycast_pygame_demo as demo
+    root_screen = demo.get_root_screen(header['viewport'])
+    level, _, camera, interface = demo.build_scene(root_screen)
+    for tick, player in enumerate(replay_poses(header, ticks, level)):
+        camera.player = player
+        demo.draw_frame(root_screen, camera, interface)
+        rgb = pygame.image.tobytes(root_screen, 'RGB')
+        # кадр целиком, сжатый: сравнение с допуском идёт по всем точкам, а не по уменьшенной копии,
+        # иначе мелкие изменения усредняются и проходят незамеченными
+        yield {'tick': tick, 'pose': pose_of(player),
+               'z_crc': z_map_checksum(camera.z_map), 'frame_crc': zlib.crc32(rgb),
+               'z_map': camera.z_map, 'pixels': base64.b64encode(zlib.compress(rgb)).decode('ascii')}
+    pygame.quit()
+
+
+def _unpack_pixels(frame):
+    return zlib.decompress(base64.b64decode(frame['pixels']))
+
+
+def play(log_path, report_path, renderer=None):
+    """
+        Воспроизводит лог и пишет отчёт по кадрам. Вернёт количество кадров
+    """
+    header, ticks = load_log(log_path)
+    renderer = renderer if renderer else header['renderer']
+    frames = play_curses(header, ticks) if renderer == 'curses' else play_pygame(header, ticks)
+    count = 0
+    with open(report_path, 'w', encoding='utf-8') as report:
+        for frame in frames:
+            report.write(json.dumps(frame) + '\n')
+            count += 1
+    return count
+
+
+def frame_renderer(frame):
+    """
+        Через какую камеру нарисован кадр отчёта: у pygame есть точки кадра, у консоли - текст
+    """
+    if 'pixels' in frame:
+        return 'pygame'
+    if 'text' in frame:
+        return 'curses'
+    return None
+
+
+def compare_frames(reference, candidate, z_tolerance=0.0, pixel_tolerance=0, max_diff_ratio=0.0):
+    """
+        Сравнивает два кадра отчёта. Вернёт список расхождений (пустой, если кадры совпадают в пределах допуска):
+        z_map сравнивается поэлементно с допуском z_tolerance,
+        картинка — по всем точкам кадра (или по символам для консоли): точка отличается, если какой-то
+        её канал разошёлся больше чем на pixel_tolerance, и доля таких точек не должна превышать max_diff_ratio.
+        При нулевых допусках любое расхождение контрольной суммы кадра - ошибка
+    """
+    problems = []
+    if reference['z_crc'] != candidate['z_crc']:
+        if len(reference['z_map']) != len(candidate['z_map']):
+            problems.append(f'z_map length {len(reference["z_map"])} != {len(candidate["z_map"])}')
+        else:
+            z_diff = max(abs(a - b) for a, b in zip(reference['z_map'], candidate['z_map']))
+            if z_diff > z_tolerance:
+                problems.append(f'z_map differs by {z_diff:.6f}')
+
+    if frame_renderer(reference) is None or frame_renderer(candidate) is None:
+        problems.append('frame has no image data (pixels or text)')
+    elif frame_renderer(reference) != frame_renderer(candidate):
+        problems.append(f'renderer {frame_renderer(reference)} != {frame_renderer(candidate)}')
+    elif reference['frame_crc'] != candidate['frame_crc']:
+        if 'pixels' in reference:
+            a, b = _unpack_pixels(reference), _unpack_pixels(candidate)
+            point_count = len(a) // 3
+            diff_count = sum(1 for i in range(0, min(len(a), len(b)), 3)
+                             if abs(a[i] - b[i]) > pixel_tolerance or abs(a[i + 1] - b[i + 1]) > pixel_tolerance
+                             or abs(a[i + 2] - b[i + 2]) > pixel_tolerance)
+        else:
+            a, b = reference['text'], candidate['text']
+            point_count = len(a)
+            diff_count = sum(1 for ca, cb in zip(a, b) if ca != cb)
+        diff_ratio = diff_count / max(point_count, 1) if len(a) == len(b) else 1.0
+        if pixel_tolerance == 0 and max_diff_ratio == 0:
+            problems.append(f'frame checksum differs: {diff_count} points ({diff_ratio:.2%}) changed')
+        elif diff_ratio > max_diff_ratio:
+            problems.append(f'image differs in {diff_count} points ({diff_ratio:.2%})')
+    return problems
+
+
+def compare(reference_path, candidate_path, z_tolerance=0.0, pixel_tolerance=0, max_diff_ratio=0.0):
+    """
+        Сравнивает два отчёта покадрово. Вернёт список строк с описанием расхождений
+    """
+    with open(reference_path, encoding='utf-8') as reference, open(candidate_path, encoding='utf-8') as candidate:
+        reference = [json.loads(line) for line in reference if line.strip()]
+        candidate = [json.loads(line) for line in candidate if line.strip()]
+    problems = []
+    # отчёты разных камер сравнивать бессмысленно: хватит одного сообщения вместо расхождения в каждом кадре
+    if reference and candidate and frame_renderer(reference[0]) != frame_renderer(candidate[0]):
+        return [f'reports come from different renderers: '
+                f'{frame_renderer(reference[0])} != {frame_renderer(candidate[0])}']
+    if len(reference) != len(candidate):
+        problems.append(f'frame count {len(reference)} != {len(candidate)}')
+    for ref_frame, cand_frame in zip(reference, candidate):
+        for problem in compare_frames(ref_frame, cand_frame, z_tolerance, pixel_tolerance, max_diff_ratio):
+            problems.append(f'tick {ref_frame["tick"]}: {problem}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного ввода и сравнение кадров')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    play_parser = subparsers.add_parser('play', help='воспроизвести лог и записать контрольные суммы кадров')
+    play_parser.add_argument('log')
+    play_parser.add_argument('report')
+    play_parser.add_argument('--renderer', choices=('curses', 'pygame'),
+                             help='через какую камеру рендерить (по умолчанию — та, в которой записан лог)')
+
+    compare_parser = subparsers.add_parser('compare', help='сравнить два отчёта')
+    compare_parser.add_argument('reference')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--z-tolerance', type=float, default=0.0)
+    compare_parser.add_argument('--pixel-tolerance', type=int, default=0)
+    compare_parser.add_argument('--max-diff-ratio', type=float, default=0.0)
+
+    args = parser.parse_args()
+    if args.command == 'play':
+        count = play(args.log, args.report, args.renderer)
+        print(f'{count} frames written to {args.report}')
+        return 0
+
+    problems = compare(args.reference, args.candidate, args.z_tolerance, args.pixel_tolerance, args.max_diff_ratio)
+    for problem in problems:
+        print(problem)
+    print('OK' if not problems else f'{len(problems)} mismatches')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())